@@ -5,7 +5,8 @@ PMC Food Science XML Downloader
 Download food science articles as XML only (no images/attachments).
 Uses oa_file_list.csv to ensure articles exist, then fetches XML via Entrez API.
 
-Estimated size: ~15-25 GB for 100k+ articles (vs 750GB for tar.gz)
+Estimated size: ~15-25 GB for 100k+ articles (vs 750GB for tar.gz), stored
+zstd-compressed as PMCxxx.xml.zst (roughly a tenth of that on disk)
 
 Usage:
     python pmc_downloader_xml.py [OPTIONS]
@@ -15,38 +16,64 @@ Author: FoodmoleGPT Team
 
 import os
 import sys
+import io
 import csv
-import json
 import time
 import logging
 import argparse
+import queue
 import threading
+import xml.etree.ElementTree as ET
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Set, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Set, Optional, Tuple, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import chain
+from multiprocessing import Pool, cpu_count
 
-from Bio import Entrez
+import ahocorasick
+import httpx
+import orjson
+import zstandard as zstd
 from tqdm import tqdm
 
 import config
 
+# Keep the usual JATS prefixes when re-serializing articles split out of a batch
+ET.register_namespace("xlink", "http://www.w3.org/1999/xlink")
+ET.register_namespace("mml", "http://www.w3.org/1998/Math/MathML")
+ET.register_namespace("ali", "http://www.niso.org/schemas/ali/1.0/")
+
 
 class RateLimiter:
-    """Thread-safe rate limiter for NCBI API requests."""
+    """Thread-safe token-bucket rate limiter for NCBI API requests.
+    
+    Up to `burst` requests may start at once; tokens refill continuously at
+    `max_per_second`. Any one-second window therefore sees at most
+    burst + max_per_second requests, so the default burst of 1 keeps 9 req/s
+    within NCBI's 10 req/s. Workers sleep outside the lock, so waiting never
+    blocks other threads.
+    """
     
-    def __init__(self, max_per_second: float = 9.0):
-        self.min_interval = 1.0 / max_per_second
+    def __init__(self, max_per_second: float = 9.0, burst: float = 1.0):
+        self.refill_rate = max_per_second
+        self.max_tokens = burst
+        self.tokens = burst
         self.lock = threading.Lock()
-        self.last_time = 0.0
+        self.last_time = time.monotonic()
     
     def wait(self):
-        with self.lock:
-            now = time.monotonic()
-            elapsed = now - self.last_time
-            if elapsed < self.min_interval:
-                time.sleep(self.min_interval - elapsed)
-            self.last_time = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.max_tokens,
+                                  self.tokens + (now - self.last_time) * self.refill_rate)
+                self.last_time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.refill_rate
+            time.sleep(delay)
 
 
 # =============================================================================
@@ -80,6 +107,15 @@ FOOD_KEYWORDS = [
     "nutrients", "foods", "beverages",
 ]
 
+# oa_file_list.csv is filtered in newline-aligned chunks of this size
+CSV_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Aho-Corasick automaton over all keywords (one linear scan per citation)
+FOOD_KW_AUTOMATON = ahocorasick.Automaton()
+for _kw in FOOD_KEYWORDS:
+    FOOD_KW_AUTOMATON.add_word(_kw.lower(), _kw)
+FOOD_KW_AUTOMATON.make_automaton()
+
 
 # =============================================================================
 # Setup
@@ -110,12 +146,75 @@ def setup_logging(log_dir: Path) -> logging.Logger:
     return logger
 
 
-def setup_entrez():
-    """Configure Entrez with email and API key."""
-    Entrez.email = config.NCBI_EMAIL
-    Entrez.tool = config.NCBI_TOOL
+EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+
+# Shared HTTP/2 client (set up by setup_session), reused by all workers
+client: Optional[httpx.Client] = None
+efetch_params: Dict[str, str] = {}
+
+
+def setup_session(num_workers: int = 8):
+    """Create the shared HTTP/2 client for efetch with email and API key."""
+    global client
+    # All worker threads multiplex over one HTTP/2 connection; the extra
+    # slots only come into play if the server falls back to HTTP/1.1.
+    # Retries are handled by the download loops, not the transport.
+    client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=num_workers,
+                            max_keepalive_connections=num_workers),
+        timeout=config.REQUEST_TIMEOUT,
+    )
+    
+    efetch_params.clear()
+    efetch_params["tool"] = config.NCBI_TOOL
+    efetch_params["email"] = config.NCBI_EMAIL
     if config.NCBI_API_KEY:
-        Entrez.api_key = config.NCBI_API_KEY
+        efetch_params["api_key"] = config.NCBI_API_KEY
+
+
+class ResponseStream(io.RawIOBase):
+    """Read-only file object over a streamed (decoded) httpx response body."""
+    
+    def __init__(self, resp: httpx.Response):
+        self._resp = resp
+        self._chunks = resp.iter_bytes()
+        self._pending = memoryview(b"")
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, b) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+    
+    def close(self):
+        self._resp.close()
+        super().close()
+
+
+def efetch(ids: str) -> ResponseStream:
+    """GET efetch.fcgi for comma-separated PMC IDs over the shared client.
+    
+    Returns the response body as a stream; the caller must close it.
+    """
+    params = {"db": "pmc", "id": ids, "rettype": "xml", "retmode": "xml"}
+    params.update(efetch_params)
+    request = client.build_request("GET", EFETCH_URL, params=params)
+    resp = client.send(request, stream=True)
+    try:
+        resp.raise_for_status()
+    except httpx.HTTPStatusError:
+        resp.close()
+        raise
+    return ResponseStream(resp)
 
 
 # =============================================================================
@@ -124,76 +223,393 @@ def setup_entrez():
 
 def matches_food_keywords(citation: str) -> bool:
     """Check if article citation matches food science keywords."""
-    citation_lower = citation.lower()
-    return any(kw.lower() in citation_lower for kw in FOOD_KEYWORDS)
+    return next(FOOD_KW_AUTOMATON.iter(citation.lower()), None) is not None
+
+
+def _field(row: List[str], idx: Optional[int]) -> str:
+    """Return row[idx], or '' if the column is missing."""
+    if idx is None or idx >= len(row):
+        return ''
+    return row[idx]
+
+
+def _filter_csv_chunk(task: Tuple[bytes, Tuple[int, int, Optional[int], Optional[int]]]
+                      ) -> Tuple[int, List[Dict]]:
+    """Filter one newline-aligned chunk of oa_file_list.csv (worker process).
+    
+    Returns: (rows_scanned, matching_articles)
+    """
+    chunk, (citation_idx, pmcid_idx, pmid_idx, license_idx) = task
+    width = max(citation_idx, pmcid_idx) + 1
+    
+    matches = []
+    total_rows = 0
+    text = chunk.decode('utf-8', errors='ignore')
+    
+    for row in csv.reader(io.StringIO(text)):
+        if not row:
+            continue
+        total_rows += 1
+        if len(row) < width:
+            continue
+        
+        citation = row[citation_idx]
+        
+        if matches_food_keywords(citation):
+            pmcid = row[pmcid_idx]
+            # Extract numeric ID (remove 'PMC' prefix)
+            pmc_num = pmcid.replace('PMC', '') if pmcid.startswith('PMC') else pmcid
+            
+            matches.append({
+                'pmcid': pmcid,
+                'pmc_num': pmc_num,
+                'pmid': _field(row, pmid_idx),
+                'citation': citation,
+                'license': _field(row, license_idx),
+            })
+    
+    return total_rows, matches
+
+
+def _iter_csv_chunks(f, chunk_bytes: int):
+    """Yield byte chunks of an open binary file, each ending on a newline."""
+    while True:
+        chunk = f.read(chunk_bytes)
+        if not chunk:
+            return
+        yield chunk + f.readline()
 
 
 def filter_food_articles(csv_path: Path, logger: logging.Logger,
-                         max_articles: Optional[int] = None) -> List[Dict]:
-    """Filter oa_file_list.csv for food science articles."""
+                         max_articles: Optional[int] = None,
+                         num_workers: Optional[int] = None) -> Iterator[Dict]:
+    """Filter oa_file_list.csv for food science articles.
+    
+    The file is split into newline-aligned chunks of CSV_CHUNK_BYTES which are
+    filtered in a process pool. Matches are yielded in file order as soon as
+    their chunk is done, so downloading can start while the scan continues.
+    """
     logger.info(f"Reading {csv_path}...")
     
-    food_articles = []
+    found = 0
     total_rows = 0
+    num_workers = num_workers or cpu_count()
     
-    with open(csv_path, 'r', encoding='utf-8', errors='ignore') as f:
-        reader = csv.DictReader(f)
+    with open(csv_path, 'rb') as f:
+        # Resolve column positions once from the header row
+        header_line = f.readline().decode('utf-8', errors='ignore')
+        header = next(csv.reader([header_line]), [])
+        columns = {name: i for i, name in enumerate(header)}
+        indices = (
+            columns['Article Citation'],
+            columns['Accession ID'],
+            columns.get('PMID'),
+            columns.get('License'),
+        )
         
-        for row in tqdm(reader, desc="Filtering articles", unit="row"):
-            total_rows += 1
-            
-            citation = row.get('Article Citation', '')
-            
-            if matches_food_keywords(citation):
-                pmcid = row.get('Accession ID', '')
-                # Extract numeric ID (remove 'PMC' prefix)
-                pmc_num = pmcid.replace('PMC', '') if pmcid.startswith('PMC') else pmcid
+        tasks = ((chunk, indices) for chunk in _iter_csv_chunks(f, CSV_CHUNK_BYTES))
+        pbar = tqdm(total=csv_path.stat().st_size, desc="Filtering articles",
+                    unit="B", unit_scale=True)
+        pbar.update(len(header_line.encode('utf-8')))
+        
+        with Pool(num_workers) as pool:
+            for rows, matches in pool.imap(_filter_csv_chunk, tasks, chunksize=1):
+                total_rows += rows
+                pbar.update(CSV_CHUNK_BYTES)
                 
-                food_articles.append({
-                    'pmcid': pmcid,
-                    'pmc_num': pmc_num,
-                    'pmid': row.get('PMID', ''),
-                    'citation': citation,
-                    'license': row.get('License', ''),
-                })
+                if max_articles and found + len(matches) >= max_articles:
+                    matches = matches[:max_articles - found]
+                found += len(matches)
+                yield from matches
                 
-                if max_articles and len(food_articles) >= max_articles:
+                if max_articles and found >= max_articles:
                     break
+        
+        pbar.close()
     
     logger.info(f"Scanned {total_rows:,} articles")
-    logger.info(f"Found {len(food_articles):,} food science articles")
+    logger.info(f"Found {found:,} food science articles")
+    log_download_estimate(found, logger)
+
+
+def log_download_estimate(n_articles: int, logger: logging.Logger):
+    """Log the expected download size for n_articles."""
+    est_size_gb = n_articles * 0.15 / 1024  # ~150KB per XML
+    logger.info(f"Estimated download size: ~{est_size_gb:.1f} GB")
+
+
+# Articles an ArticleScan may hold for the downloader; far above the ~110k
+# matches in the OA list, so the scan always runs ahead of the downloads
+SCAN_QUEUE_SIZE = 1_000_000
+
+_SCAN_END = object()
+
+
+class ArticleScan:
+    """Drain an article filter on a background thread.
+    
+    Each article is appended to articles_file (JSONL) and queued for the
+    iterating consumer. Lines go to a .part file that is renamed as soon as
+    the filter is exhausted, so the cache exists even if the download is
+    interrupted, and --resume never picks up a partially filtered list.
+    `pmcids` lists the articles found so far; `done` is set once the cache
+    has been written.
+    """
+    
+    def __init__(self, articles: Iterable[Dict], articles_file: Path):
+        self.pmcids: List[str] = []
+        self.done = False
+        self._queue: queue.Queue = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+        self._thread = threading.Thread(
+            target=self._run, args=(articles, articles_file),
+            name="article-scan", daemon=True,
+        )
+        self._thread.start()
+    
+    def _run(self, articles: Iterable[Dict], articles_file: Path):
+        try:
+            part_file = articles_file.with_name(articles_file.name + ".part")
+            with open(part_file, 'wb') as f:
+                for article in articles:
+                    f.write(orjson.dumps(article, option=orjson.OPT_APPEND_NEWLINE))
+                    self.pmcids.append(article['pmcid'])
+                    self._queue.put(article)
+            os.replace(part_file, articles_file)
+            self.done = True
+            self._queue.put(_SCAN_END)
+        except BaseException as e:
+            self._queue.put(e)  # re-raised in the consumer
     
-    return food_articles
+    def __iter__(self) -> Iterator[Dict]:
+        while True:
+            item = self._queue.get()
+            if item is _SCAN_END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+def load_articles(articles_file: Path) -> List[Dict]:
+    """Load a filtered article list written by ArticleScan.
+    
+    A .json file is read as the single JSON list written by older versions.
+    """
+    with open(articles_file, 'rb') as f:
+        if articles_file.suffix == ".json":
+            return orjson.loads(f.read())
+        return [orjson.loads(line) for line in f if line.strip()]
 
 
 # =============================================================================
 # Download Functions
 # =============================================================================
 
+# Chunk size for streaming responses to disk
+COPY_BUFFER_SIZE = 64 * 1024
+
+# Articles are stored zstd-compressed; preprocess_xml.py and
+# pmc_esearch_collector.py (via iter_article_pmcids) read both this and
+# plain .xml (older downloads, pmc_expansion_downloader.py)
+XML_SUFFIX = ".xml.zst"
+ZSTD_LEVEL = 3
+
+# Per-article download state in download_articles
+STATE_DONE = 1
+STATE_FAILED = 2
+
+# Per-thread state (reusable copy buffer, zstd compressor)
+_thread_local = threading.local()
+
+# Linux O_TMPFILE (0 elsewhere) and, per output directory, whether unnamed
+# files can be created and linked there (see _tmpfile_supported)
+O_TMPFILE = getattr(os, "O_TMPFILE", 0)
+_tmpfile_dirs: Dict[Path, bool] = {}
+
+
+def iter_article_pmcids(xml_dir: Path) -> Iterator[str]:
+    """Yield the PMCIDs of downloaded article files (.xml or .xml.zst) in xml_dir."""
+    with os.scandir(xml_dir) as it:
+        for e in it:
+            if (e.name.startswith("PMC") and e.name.endswith((".xml", XML_SUFFIX))
+                    and e.stat().st_size > 100):
+                yield e.name.split(".", 1)[0]  # e.g., "PMC10000368"
+
+
+def progress_log_path(progress_file: Path) -> Path:
+    """Append-only log that records results between JSON snapshots."""
+    return progress_file.with_suffix(".log")
+
+
 def load_progress(progress_file: Path) -> Dict:
-    """Load download progress."""
+    """Load download progress (JSON snapshot, then replay the append-only log)."""
+    progress = {"downloaded": [], "failed": [], "last_updated": None}
     if progress_file.exists():
-        with open(progress_file, 'r') as f:
-            return json.load(f)
-    return {"downloaded": [], "failed": [], "last_updated": None}
+        with open(progress_file, 'rb') as f:
+            progress = orjson.loads(f.read())
+    
+    log_file = progress_log_path(progress_file)
+    if log_file.exists():
+        downloaded = set(progress["downloaded"])
+        failed = set(progress["failed"])
+        with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                # A torn last line (crash mid-write) is ignored
+                if not line.endswith("\n"):
+                    break
+                parts = line.split(" ", 2)
+                if len(parts) < 2:
+                    continue
+                status, pmcid = parts[0], parts[1].strip()
+                if status == "OK":
+                    downloaded.add(pmcid)
+                elif status == "FAIL":
+                    failed.add(pmcid)
+        progress["downloaded"] = list(downloaded)
+        progress["failed"] = list(failed)
+    
+    return progress
 
 
 def save_progress(progress_file: Path, progress: Dict):
-    """Save download progress."""
+    """Save a full progress snapshot and reset the append-only log."""
     progress["last_updated"] = datetime.now().isoformat()
-    with open(progress_file, 'w') as f:
-        json.dump(progress, f)
+    with open(progress_file, 'wb') as f:
+        f.write(orjson.dumps(progress))
+    # Everything in the log is now part of the snapshot
+    progress_log_path(progress_file).unlink(missing_ok=True)
+
+
+def _thread_buffer() -> memoryview:
+    """Return this thread's reusable copy buffer."""
+    buf = getattr(_thread_local, "buf", None)
+    if buf is None:
+        buf = _thread_local.buf = memoryview(bytearray(COPY_BUFFER_SIZE))
+    return buf
+
+
+def _thread_compressor() -> zstd.ZstdCompressor:
+    """Return this thread's zstd compressor (compressors are not thread-safe)."""
+    cctx = getattr(_thread_local, "cctx", None)
+    if cctx is None:
+        cctx = _thread_local.cctx = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+    return cctx
+
+
+def _read_head(stream, size: int) -> bytes:
+    """Read up to `size` bytes from a stream (fewer only at EOF)."""
+    chunks = []
+    got = 0
+    while got < size:
+        chunk = stream.read(size - got)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        got += len(chunk)
+    return b"".join(chunks)
+
+
+def _write_all(fd: int, data) -> None:
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _link_fd(fd: int, path: Path) -> None:
+    """Give the unnamed (O_TMPFILE) file behind fd a name: linkat via /proc."""
+    os.link(f"/proc/self/fd/{fd}", path)
+
+
+def _tmpfile_supported(directory: Path) -> bool:
+    """Check once per directory that O_TMPFILE + linkat work there.
+    
+    Needs Linux, a filesystem with O_TMPFILE support and a mounted /proc;
+    probed with an empty file up front because a streamed body cannot be
+    replayed if linking fails after the download.
+    """
+    supported = _tmpfile_dirs.get(directory)
+    if supported is None:
+        supported = False
+        if O_TMPFILE:
+            probe = directory / f".tmpfile-probe-{os.getpid()}-{threading.get_ident()}"
+            try:
+                fd = os.open(directory, O_TMPFILE | os.O_WRONLY, 0o644)
+                try:
+                    _link_fd(fd, probe)
+                    supported = True
+                finally:
+                    os.close(fd)
+                    probe.unlink(missing_ok=True)
+            except OSError:
+                pass
+        _tmpfile_dirs[directory] = supported
+    return supported
+
+
+def _publish_fd(fd: int, output_file: Path) -> None:
+    """Link a finished O_TMPFILE file into place, replacing any existing file."""
+    try:
+        _link_fd(fd, output_file)
+    except FileExistsError:
+        # linkat never overwrites: link beside the target, then rename over it
+        tmp_path = output_file.with_name(output_file.name + ".part")
+        tmp_path.unlink(missing_ok=True)
+        _link_fd(fd, tmp_path)
+        os.replace(tmp_path, output_file)
+
+
+def write_xml(output_file: Path, head, stream=None) -> int:
+    """
+    Write `head` and then the rest of `stream` (if given) to output_file,
+    zstd-compressed on the fly.
+    
+    Data goes through os.write and the thread's copy buffer (no per-file
+    BufferedWriter). On Linux the file is created unnamed (O_TMPFILE) and
+    linked into place once complete, so a crash leaves nothing behind;
+    elsewhere a .part file is renamed into place instead.
+    
+    Returns: number of uncompressed bytes written
+    """
+    tmp_path = None
+    if _tmpfile_supported(output_file.parent):
+        fd = os.open(output_file.parent, O_TMPFILE | os.O_WRONLY, 0o644)
+    else:
+        tmp_path = output_file.with_name(output_file.name + ".part")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        cobj = _thread_compressor().compressobj()
+        _write_all(fd, cobj.compress(head))
+        total = len(head)
+        if stream is not None:
+            buf = _thread_buffer()
+            while True:
+                n = stream.readinto(buf)
+                if not n:
+                    break
+                _write_all(fd, cobj.compress(buf[:n]))
+                total += n
+        _write_all(fd, cobj.flush())
+        if tmp_path is None:
+            _publish_fd(fd, output_file)
+    except BaseException:
+        os.close(fd)
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        raise
+    os.close(fd)
+    if tmp_path is not None:
+        os.replace(tmp_path, output_file)
+    return total
 
 
 def download_xml(pmc_num: str, output_dir: Path, 
                  rate_limiter: RateLimiter, logger: logging.Logger) -> tuple:
     """
-    Download a single article XML via Entrez efetch (thread-safe).
+    Download a single article XML via efetch (thread-safe).
     
     Returns: (pmcid, success, error_message)
     """
     pmcid = f"PMC{pmc_num}"
-    output_file = output_dir / f"{pmcid}.xml"
+    output_file = output_dir / f"{pmcid}{XML_SUFFIX}"
     
     # Skip if already exists
     if output_file.exists() and output_file.stat().st_size > 100:
@@ -204,31 +620,28 @@ def download_xml(pmc_num: str, output_dir: Path,
             # Rate limit before each request
             rate_limiter.wait()
             
-            # Fetch XML via Entrez
-            handle = Entrez.efetch(
-                db="pmc",
-                id=pmc_num,
-                rettype="xml",
-                retmode="xml"
-            )
-            content = handle.read()
-            handle.close()
-            
-            # Check if valid XML
-            if not content or len(content) < 200:
-                if attempt < config.MAX_RETRIES - 1:
-                    time.sleep(1)
-                    continue
-                return (pmcid, False, "empty response")
-            
-            # Check for error messages in response
-            content_str = content.decode('utf-8', errors='ignore')[:500]
-            if '<error>' in content_str.lower() or 'id not found' in content_str.lower():
-                return (pmcid, False, "article not available via API")
-            
-            # Save XML
-            with open(output_file, 'wb') as f:
-                f.write(content)
+            # Fetch XML over the shared client; only the head is held in
+            # memory, the rest is streamed to disk
+            stream = efetch(pmc_num)
+            try:
+                head = _read_head(stream, 500)
+                
+                # Check if valid XML
+                if len(head) < 200:
+                    if attempt < config.MAX_RETRIES - 1:
+                        time.sleep(1)
+                        continue
+                    return (pmcid, False, "empty response")
+                
+                # Check for error messages in response
+                content_str = head.decode('utf-8', errors='ignore').lower()
+                if '<error>' in content_str or 'id not found' in content_str:
+                    return (pmcid, False, "article not available via API")
+                
+                # Save XML
+                write_xml(output_file, head, stream)
+            finally:
+                stream.close()
             
             return (pmcid, True, None)
             
@@ -241,87 +654,263 @@ def download_xml(pmc_num: str, output_dir: Path,
     return (pmcid, False, "max retries exceeded")
 
 
-def download_articles(articles: List[Dict], output_dir: Path,
+def download_xml_batch(pmc_nums: List[str], output_dir: Path,
+                       rate_limiter: RateLimiter, logger: logging.Logger) -> List[tuple]:
+    """
+    Download a batch of article XMLs with a single efetch (thread-safe).
+    
+    The <pmc-articleset> response is split on its <article> children, and each
+    article is written to PMCxxx.xml.zst (wrapped in its own <pmc-articleset>, the
+    same layout a single-ID efetch returns). IDs missing from the response are
+    retried one by one via download_xml.
+    
+    Returns: list of (pmcid, success, error_message)
+    """
+    results = []
+    pending = []
+    for pmc_num in pmc_nums:
+        output_file = output_dir / f"PMC{pmc_num}{XML_SUFFIX}"
+        if output_file.exists() and output_file.stat().st_size > 100:
+            results.append((f"PMC{pmc_num}", True, "already exists"))
+        else:
+            pending.append(pmc_num)
+    
+    if not pending:
+        return results
+    
+    saved: Set[str] = set()
+    for attempt in range(config.MAX_RETRIES):
+        try:
+            # Rate limit once per batch request
+            rate_limiter.wait()
+            
+            stream = efetch(",".join(pending))
+            try:
+                saved.update(_split_articleset(stream, output_dir))
+            finally:
+                stream.close()
+            break
+            
+        except Exception as e:
+            logger.debug(f"Batch efetch failed ({len(pending)} IDs, attempt {attempt + 1}): {e}")
+            if attempt < config.MAX_RETRIES - 1:
+                time.sleep(1)
+    
+    for pmc_num in pending:
+        if pmc_num in saved:
+            results.append((f"PMC{pmc_num}", True, None))
+        else:
+            # Partial batch: fall back to a single-ID request
+            results.append(download_xml(pmc_num, output_dir, rate_limiter, logger))
+    
+    return results
+
+
+def _split_articleset(handle, output_dir: Path) -> Set[str]:
+    """Stream a <pmc-articleset> response and write each <article> to disk.
+    
+    Returns the set of numeric PMC IDs that were saved.
+    """
+    saved = set()
+    root = None
+    depth = 0
+    
+    for event, elem in ET.iterparse(handle, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        
+        depth -= 1
+        if depth != 1 or elem.tag != "article":
+            continue
+        
+        pmc_num = ""
+        for aid in elem.iter("article-id"):
+            if aid.get("pub-id-type") in ("pmc", "pmcid") and aid.text:
+                pmc_num = aid.text.strip().replace("PMC", "")
+                break
+        
+        if pmc_num:
+            elem.tail = None
+            content = (
+                b'<?xml version="1.0" encoding="UTF-8"?>\n<pmc-articleset>'
+                + ET.tostring(elem, encoding="utf-8")
+                + b"</pmc-articleset>\n"
+            )
+            write_xml(output_dir / f"PMC{pmc_num}{XML_SUFFIX}", content)
+            saved.add(pmc_num)
+        
+        # Release the finished article
+        root.clear()
+    
+    return saved
+
+
+def _known_pmcids(articles: Iterable[Dict]) -> Optional[List[str]]:
+    """All PMCIDs of `articles` if already known (a list or a finished scan)."""
+    if isinstance(articles, list):
+        return [a['pmcid'] for a in articles]
+    if isinstance(articles, ArticleScan) and articles.done:
+        return articles.pmcids
+    return None
+
+
+def _iter_batches(articles: Iterable[Dict], pmcid_state: Dict[str, int],
+                  batch_size: int) -> Iterator[List[str]]:
+    """Group not-yet-processed articles into efetch batches of PMC numbers."""
+    batch = []
+    for a in articles:
+        if a['pmcid'] in pmcid_state:
+            continue
+        batch.append(a['pmc_num'])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def download_articles(articles: Iterable[Dict], output_dir: Path,
                      progress: Dict, progress_file: Path,
                      logger: logging.Logger,
-                     num_workers: int = 8) -> Dict:
-    """Download articles concurrently with progress tracking."""
+                     num_workers: int = 8) -> Optional[Dict]:
+    """Download articles concurrently with progress tracking.
+    
+    `articles` may be a lazy iterable (e.g. an ArticleScan of the CSV
+    filter); batches are pulled from it only as workers free up, and the
+    number to download is reported once the full list is known.
+    
+    Returns the updated progress, or None if there were no articles at all.
+    """
+    # Wait for the first article (the filter may still be scanning) so an
+    # empty list is reported as such rather than as "already downloaded"
+    source = articles
+    articles = iter(articles)
+    first = next(articles, None)
+    if first is None:
+        logger.warning("No articles found!")
+        return None
+    articles = chain([first], articles)
+    
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    downloaded_set: Set[str] = set(progress["downloaded"])
-    failed_set: Set[str] = set(progress["failed"])
+    # One state per processed PMCID; pending articles are simply absent
+    pmcid_state: Dict[str, int] = dict.fromkeys(progress["failed"], STATE_FAILED)
+    pmcid_state.update(dict.fromkeys(progress["downloaded"], STATE_DONE))
     
-    # Also check existing files on disk (in case progress file is incomplete)
-    existing_files = set()
-    for f in output_dir.glob("PMC*.xml"):
-        if f.stat().st_size > 100:
-            existing_files.add(f.stem)
-    downloaded_set.update(existing_files)
+    # Also check existing files on disk (in case progress file is incomplete);
+    # plain .xml files from earlier runs count as downloaded too
+    pmcid_state.update(dict.fromkeys(iter_article_pmcids(output_dir), STATE_DONE))
     
-    # Filter out already processed
-    to_download = [
-        a for a in articles 
-        if a['pmcid'] not in downloaded_set and a['pmcid'] not in failed_set
-    ]
+    # Articles to download are those not processed before this run; they can
+    # be counted once the full article list is known
+    previous = set(pmcid_state)
     
-    if not to_download:
-        logger.info("All articles already downloaded!")
-        return progress
+    def count_pending() -> Optional[int]:
+        pmcids = _known_pmcids(source)
+        if pmcids is None:
+            return None
+        return sum(1 for pmcid in pmcids if pmcid not in previous)
     
     # Rate limiter: 9 req/s (leave margin under NCBI's 10 req/s limit)
     rate_limiter = RateLimiter(max_per_second=9.0)
     
-    logger.info(f"Downloading {len(to_download):,} XML files...")
-    logger.info(f"Previously downloaded: {len(downloaded_set):,}")
-    logger.info(f"Previously failed: {len(failed_set):,}")
+    # Already processed articles are skipped as the batches are formed
+    batch_size = config.BATCH_SIZE
+    batches = _iter_batches(articles, pmcid_state, batch_size)
+    
+    prev_failed = sum(1 for state in pmcid_state.values() if state == STATE_FAILED)
+    
+    to_download = count_pending()
+    if to_download == 0:
+        logger.info("All articles already downloaded!")
+        return progress
+    if to_download is not None:
+        logger.info(f"Downloading {to_download:,} XML files...")
+    else:
+        logger.info("Downloading XML files (count follows once the CSV scan finishes)...")
+    logger.info(f"Previously downloaded: {len(pmcid_state) - prev_failed:,}")
+    logger.info(f"Previously failed: {prev_failed:,}")
     logger.info(f"Workers: {num_workers} threads")
+    logger.info(f"Batch size: {batch_size} IDs per efetch")
     logger.info(f"Rate limit: 9 requests/second")
     
     success_count = 0
     fail_count = 0
-    progress_lock = threading.Lock()
     
-    pbar = tqdm(total=len(to_download), desc="Downloading", unit="xml")
+    # One "OK PMCxxx" / "FAIL PMCxxx reason" line per article; the JSON
+    # snapshot is only rewritten once the run is over
+    progress_log = open(progress_log_path(progress_file), 'a', encoding='utf-8')
+    
+    pbar = tqdm(total=to_download, desc="Downloading", unit="xml")
+    
+    # Keep only a bounded number of batches in flight instead of
+    # submitting everything up front
+    max_inflight = 2 * num_workers
+    inflight = set()
     
     with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        futures = {
-            executor.submit(
-                download_xml, a['pmc_num'], output_dir, rate_limiter, logger
-            ): a for a in to_download
-        }
-        
-        for future in as_completed(futures):
-            pmcid, success, error = future.result()
+        while True:
+            for batch in batches:
+                inflight.add(executor.submit(
+                    download_xml_batch, batch, output_dir, rate_limiter, logger
+                ))
+                if len(inflight) >= max_inflight:
+                    break
+            
+            if not inflight:
+                break
             
-            with progress_lock:
-                if success:
-                    downloaded_set.add(pmcid)
-                    success_count += 1
-                else:
-                    failed_set.add(pmcid)
-                    fail_count += 1
-                    logger.debug(f"{pmcid}: {error}")
+            done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+            
+            if to_download is None:
+                to_download = count_pending()
+                if to_download is not None:
+                    logger.info(f"Articles to download: {to_download:,}")
+                    pbar.total = to_download
+                    pbar.refresh()
+            
+            for future in done:
+                batch_results = future.result()
                 
-                pbar.update(1)
-                pbar.set_postfix(ok=success_count, fail=fail_count)
+                lines = []
+                for pmcid, success, error in batch_results:
+                    if success:
+                        pmcid_state[pmcid] = STATE_DONE
+                        success_count += 1
+                        lines.append(f"OK {pmcid}\n")
+                    else:
+                        pmcid_state[pmcid] = STATE_FAILED
+                        fail_count += 1
+                        logger.debug(f"{pmcid}: {error}")
+                        reason = " ".join(str(error).split())
+                        lines.append(f"FAIL {pmcid} {reason}\n")
                 
-                # Save progress every 500 articles
-                if (success_count + fail_count) % 500 == 0:
-                    progress["downloaded"] = list(downloaded_set)
-                    progress["failed"] = list(failed_set)
-                    save_progress(progress_file, progress)
+                progress_log.write("".join(lines))
+                progress_log.flush()
+                
+                pbar.update(len(batch_results))
+                pbar.set_postfix(ok=success_count, fail=fail_count)
     
     pbar.close()
+    progress_log.close()
+    
+    if not success_count and not fail_count:
+        logger.info("All articles already downloaded!")
+        return progress
     
     # Final save
-    progress["downloaded"] = list(downloaded_set)
-    progress["failed"] = list(failed_set)
+    progress["downloaded"] = [k for k, v in pmcid_state.items() if v == STATE_DONE]
+    progress["failed"] = [k for k, v in pmcid_state.items() if v == STATE_FAILED]
     save_progress(progress_file, progress)
     
     logger.info(f"\nDownload complete!")
     logger.info(f"  Successful: {success_count:,}")
     logger.info(f"  Failed: {fail_count:,}")
-    logger.info(f"  Total downloaded: {len(downloaded_set):,}")
+    logger.info(f"  Total downloaded: {len(progress['downloaded']):,}")
+    return progress
 
 
 # =============================================================================
@@ -371,7 +960,7 @@ def main():
     
     xml_dir.mkdir(parents=True, exist_ok=True)
     logger = setup_logging(logs_dir)
-    setup_entrez()
+    setup_session()
     
     logger.info("=" * 60)
     logger.info("PMC Food Science XML Downloader")
@@ -395,28 +984,31 @@ def main():
     
     # Progress and articles files
     progress_file = output_base / "download_xml_progress.json"
-    articles_file = output_base / "food_articles_xml.json"
+    articles_file = output_base / "food_articles_xml.jsonl"
+    # Output dirs from before the JSONL cache hold a single JSON list; a
+    # leftover .part means a newer scan was interrupted, so that list is stale
+    cached_file = articles_file
+    if (not cached_file.exists()
+            and not articles_file.with_name(articles_file.name + ".part").exists()):
+        cached_file = output_base / "food_articles_xml.json"
     
-    # Filter or load
-    if args.resume and articles_file.exists():
+    # Filter or load; a fresh filter is streamed straight into the download
+    if args.resume and cached_file.exists():
         logger.info("Loading previously filtered articles...")
-        with open(articles_file, 'r') as f:
-            articles = json.load(f)
+        articles = load_articles(cached_file)
         logger.info(f"Loaded {len(articles):,} articles")
+        log_download_estimate(len(articles), logger)
     else:
-        articles = filter_food_articles(csv_path, logger, args.max_results)
-        with open(articles_file, 'w') as f:
-            json.dump(articles, f)
-    
-    if not articles:
-        logger.warning("No articles found!")
-        return
-    
-    # Estimate size
-    est_size_gb = len(articles) * 0.15 / 1024  # ~150KB per XML
-    logger.info(f"Estimated download size: ~{est_size_gb:.1f} GB")
+        articles = ArticleScan(
+            filter_food_articles(csv_path, logger, args.max_results), articles_file
+        )
     
     if args.dry_run:
+        articles = list(articles)
+        if not articles:
+            logger.warning("No articles found!")
+            return
+        
         logger.info("\n[DRY RUN] Would download:")
         for a in articles[:10]:
             logger.info(f"  - {a['pmcid']}: {a['citation'][:50]}...")
@@ -426,7 +1018,8 @@ def main():
     
     # Download
     progress = load_progress(progress_file)
-    download_articles(articles, xml_dir, progress, progress_file, logger)
+    if download_articles(articles, xml_dir, progress, progress_file, logger) is None:
+        return
     
     logger.info(f"\nDone! XML files saved to: {xml_dir}")
 
@@ -22,6 +22,7 @@ from Bio import Entrez
 from tqdm import tqdm
 
 import config
+from pmc_downloader_xml import iter_article_pmcids
 
 
 # =============================================================================
@@ -330,12 +331,10 @@ def esearch_all_ids(query: str, max_results: int = None,
 
 
 def load_existing_pmcids(xml_dir: Path) -> Set[str]:
-    """Load PMCIDs of already-downloaded XML files."""
+    """Load PMCIDs of already-downloaded XML files (.xml or .xml.zst)."""
     existing = set()
     if xml_dir.exists():
-        for f in xml_dir.glob("PMC*.xml"):
-            if f.stat().st_size > 100:
-                existing.add(f.stem)  # e.g., "PMC10000368"
+        existing.update(iter_article_pmcids(xml_dir))
     return existing
 
 
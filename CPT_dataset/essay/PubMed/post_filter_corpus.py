@@ -16,6 +16,8 @@ import time
 from pathlib import Path
 from typing import Dict, List
 
+import zstandard as zstd
+
 
 CANCER_RE = re.compile(
     r"\b(cancer|tumou?r|oncolog|neoplas|carcinoma|malignan)\w*\b", re.IGNORECASE
@@ -48,12 +50,19 @@ def update_reservoir(
         reservoir[idx] = item
 
 
+def open_jsonl(path: Path):
+    """Open a JSONL file for reading, decompressing .zst on the fly."""
+    if path.suffix == ".zst":
+        return zstd.open(path, "rt", encoding="utf-8", errors="ignore")
+    return path.open("r", encoding="utf-8", errors="ignore")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Post-filter food science corpus JSONL")
     parser.add_argument(
         "--input",
         default="data/processed/intermediate/food_science_corpus.raw.jsonl",
-        help="Input JSONL path",
+        help="Input JSONL path (.jsonl or zstd-compressed .jsonl.zst)",
     )
     parser.add_argument(
         "--out-dir",
@@ -112,7 +121,7 @@ def main() -> None:
     }
 
     with (
-        input_path.open("r", encoding="utf-8", errors="ignore") as fin,
+        open_jsonl(input_path) as fin,
         keep_path.open("w", encoding="utf-8") as fkeep,
         drop_path.open("w", encoding="utf-8") as fdrop,
     ):
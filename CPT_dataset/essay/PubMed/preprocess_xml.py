@@ -19,18 +19,23 @@ Usage:
 Author: FoodmoleGPT Team
 """
 
+import io
 import os
 import sys
-import json
+import mmap
 import re
 import logging
 import argparse
 from pathlib import Path
-from typing import Dict, List, Optional
-from multiprocessing import Pool, cpu_count
-from functools import partial
-
-import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+from multiprocessing import Pool, cpu_count, set_start_method
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from operator import itemgetter
+
+import orjson
+import zstandard as zstd
+from lxml import etree as ET
 from tqdm import tqdm
 
 
@@ -38,39 +43,85 @@ from tqdm import tqdm
 # XML Parsing
 # =============================================================================
 
+# Articles are small: each file is read with a single read() and parsed from
+# memory. Comments and PIs are dropped at parse time; blank text is kept, as
+# it separates inline elements in mixed content.
+XML_PARSER = ET.XMLParser(remove_comments=True, remove_pis=True, collect_ids=False)
+
+def read_xml(xml_path: str) -> bytes:
+    """Read an article file into memory; .xml.zst is decompressed."""
+    with open(xml_path, "rb", buffering=0) as f:
+        data = f.read()
+    if xml_path.endswith(".zst"):
+        # Streamed frames carry no content size, so use a decompressobj (and
+        # a fresh decompressor: read-ahead threads call this concurrently)
+        data = zstd.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def read_xml_or_none(xml_path: str) -> Optional[bytes]:
+    """read_xml for read-ahead; errors are left to process_single_xml."""
+    try:
+        return read_xml(xml_path)
+    except Exception:
+        return None
+
+
+# Elements picked out of the parsed tree by a single tag-filtered walk
+CONTENT_TAGS = ("article-meta", "journal-meta", "body", "fig", "table-wrap")
+
+
+# Inline elements whose own text is kept but whose children are not
+TEXT_ONLY_TAGS = ("xref", "ext-link", "uri", "sup", "sub")
+
+# Image references, dropped entirely (the text after them is kept)
+SKIP_TAGS = ("graphic", "media", "inline-graphic")
+
+
+# XPath string(): all descendant text, concatenated inside libxml2
+_string_value = ET.XPath("string()", smart_strings=False)
+
+
+def prepare_text_tree(elem):
+    """
+    Prune an element tree in place so that its string value is exactly the
+    text we keep: image references are stripped and TEXT_ONLY_TAGS lose their
+    children. Run on each extracted block before any get_text() call.
+    """
+    ET.strip_elements(elem, *SKIP_TAGS, with_tail=False)
+    for inline in list(elem.iter(*TEXT_ONLY_TAGS)):
+        del inline[:]
+
+
+# Descendant lookups used by the extractors, compiled once
+_xp_article = ET.XPath("boolean(.//article)")
+_xp_article_title = ET.XPath(".//article-title")
+_xp_abstract = ET.XPath(".//abstract")
+_xp_sec = ET.XPath(".//sec")
+_xp_p = ET.XPath(".//p")
+_xp_kwd = ET.XPath(".//kwd")
+_xp_xlink_journal_title = ET.XPath(
+    ".//xlink:journal-title", namespaces={"xlink": "http://www.w3.org/1999/xlink"}
+)
+_xp_journal_title = ET.XPath(".//journal-title")
+_xp_pmc_article_id = ET.XPath(".//article-id[@pub-id-type='pmc']")
+
+
+def _first(elems):
+    """First element of an XPath result, or None."""
+    return elems[0] if elems else None
+
+
 def get_text(elem) -> str:
-    """Recursively extract all text from an XML element, including tails."""
+    """Extract all text from an XML element, including tails."""
     if elem is None:
         return ""
-    parts = []
-    if elem.text:
-        parts.append(elem.text)
-    for child in elem:
-        # Skip certain elements
-        tag = child.tag.lower() if isinstance(child.tag, str) else ""
-        if tag in ("xref", "ext-link", "uri"):
-            # Keep text content of references but skip the tag
-            if child.text:
-                parts.append(child.text)
-        elif tag in ("graphic", "media", "inline-graphic"):
-            # Skip image references
-            pass
-        elif tag == "sup":
-            if child.text:
-                parts.append(child.text)
-        elif tag == "sub":
-            if child.text:
-                parts.append(child.text)
-        else:
-            parts.append(get_text(child))
-        if child.tail:
-            parts.append(child.tail)
-    return "".join(parts)
+    return _string_value(elem)
 
 
 def extract_title(meta) -> str:
     """Extract article title."""
-    title_elem = meta.find(".//article-title")
+    title_elem = _first(_xp_article_title(meta))
     if title_elem is not None:
         return get_text(title_elem).strip()
     return ""
@@ -78,18 +129,18 @@ def extract_title(meta) -> str:
 
 def extract_abstract(meta) -> str:
     """Extract abstract text."""
-    abstract = meta.find(".//abstract")
+    abstract = _first(_xp_abstract(meta))
     if abstract is None:
         return ""
     
     # Handle structured abstracts (with sections)
-    sections = abstract.findall(".//sec")
+    sections = _xp_sec(abstract)
     if sections:
         parts = []
         for sec in sections:
-            sec_title = sec.find("title")
+            sec_title = next(sec.iterchildren("title"), None)
             title_text = get_text(sec_title).strip() if sec_title is not None else ""
-            paragraphs = sec.findall(".//p")
+            paragraphs = _xp_p(sec)
             body_text = " ".join(get_text(p).strip() for p in paragraphs)
             if title_text and body_text:
                 parts.append(f"{title_text}: {body_text}")
@@ -98,7 +149,7 @@ def extract_abstract(meta) -> str:
         return " ".join(parts)
     else:
         # Simple abstract
-        paragraphs = abstract.findall(".//p")
+        paragraphs = _xp_p(abstract)
         if paragraphs:
             return " ".join(get_text(p).strip() for p in paragraphs)
         return get_text(abstract).strip()
@@ -107,47 +158,60 @@ def extract_abstract(meta) -> str:
 def extract_keywords(meta) -> List[str]:
     """Extract keywords."""
     keywords = []
-    for kwd in meta.findall(".//kwd"):
+    for kwd in _xp_kwd(meta):
         text = get_text(kwd).strip()
         if text:
             keywords.append(text)
     return keywords
 
 
-def extract_body(article) -> List[Dict[str, str]]:
-    """Extract body sections with titles."""
-    body = article.find(".//body")
-    if body is None:
-        return []
+# Skip sections that are not useful for training
+SKIP_SECTION_TITLES = {
+    "competing interests", "conflict of interest", "conflicts of interest",
+    "credit authorship contribution statement", "authorship contribution",
+    "declaration of competing interest", "author contributions",
+    "funding", "acknowledgements", "acknowledgments", "acknowledgment",
+    "data availability", "supplementary material", "supplementary data",
+    "abbreviations", "ethics statement", "ethical approval",
+}
+
+
+def extract_caption(elem) -> str:
+    """Extract a <fig> or <table-wrap> caption as "Label: caption"."""
+    caption_elem = next(elem.iterchildren("caption"), None)
+    if caption_elem is None:
+        return ""
     
+    label_elem = next(elem.iterchildren("label"), None)
+    label = get_text(label_elem).strip() if label_elem is not None else ""
+    caption_text = get_text(caption_elem).strip()
+    if caption_text and len(caption_text) > 10:
+        if label:
+            return f"{label}: {caption_text}"
+        return caption_text
+    return ""
+
+
+def extract_body(body) -> List[Dict[str, str]]:
+    """Extract body sections with titles."""
     sections = []
     
-    # Skip sections that are not useful for training
-    skip_titles = {
-        "competing interests", "conflict of interest", "conflicts of interest",
-        "credit authorship contribution statement", "authorship contribution",
-        "declaration of competing interest", "author contributions",
-        "funding", "acknowledgements", "acknowledgments", "acknowledgment",
-        "data availability", "supplementary material", "supplementary data",
-        "abbreviations", "ethics statement", "ethical approval",
-    }
-    
     def process_section(sec, depth=0):
-        sec_title_elem = sec.find("title")
+        sec_title_elem = next(sec.iterchildren("title"), None)
         sec_title = get_text(sec_title_elem).strip() if sec_title_elem is not None else ""
         
         # Skip irrelevant sections
-        if sec_title.lower() in skip_titles:
+        if sec_title.lower() in SKIP_SECTION_TITLES:
             return
         
         # Get paragraphs in this section (not nested sections)
         paragraphs = []
-        for child in sec:
+        for child in sec.iterchildren("p", "sec"):
             if child.tag == "p":
                 text = get_text(child).strip()
                 if text:
                     paragraphs.append(text)
-            elif child.tag == "sec":
+            else:
                 # Process nested sections
                 process_section(child, depth + 1)
         
@@ -158,13 +222,13 @@ def extract_body(article) -> List[Dict[str, str]]:
                 "text": section_text,
             })
     
-    for sec in body.findall("sec"):
+    for sec in body.iterchildren("sec"):
         process_section(sec)
     
     # Handle body without sections (direct paragraphs)
     if not sections:
         paragraphs = []
-        for p in body.findall("p"):
+        for p in body.iterchildren("p"):
             text = get_text(p).strip()
             if text:
                 paragraphs.append(text)
@@ -177,81 +241,52 @@ def extract_body(article) -> List[Dict[str, str]]:
     return sections
 
 
-def extract_figure_captions(article) -> List[str]:
-    """Extract figure captions (often contain experimental conclusions)."""
-    captions = []
-    for fig in article.iter("fig"):
-        label_elem = fig.find("label")
-        caption_elem = fig.find("caption")
-        
-        if caption_elem is not None:
-            label = get_text(label_elem).strip() if label_elem is not None else ""
-            caption_text = get_text(caption_elem).strip()
-            if caption_text and len(caption_text) > 10:
-                if label:
-                    captions.append(f"{label}: {caption_text}")
-                else:
-                    captions.append(caption_text)
-    return captions
-
-
-def extract_table_captions(article) -> List[str]:
-    """Extract table captions."""
-    captions = []
-    for tw in article.iter("table-wrap"):
-        label_elem = tw.find("label")
-        caption_elem = tw.find("caption")
-        
-        if caption_elem is not None:
-            label = get_text(label_elem).strip() if label_elem is not None else ""
-            caption_text = get_text(caption_elem).strip()
-            if caption_text and len(caption_text) > 10:
-                if label:
-                    captions.append(f"{label}: {caption_text}")
-                else:
-                    captions.append(caption_text)
-    return captions
-
-
 def extract_journal(meta) -> str:
     """Extract journal name."""
-    journal = meta.find(".//{http://www.w3.org/1999/xlink}journal-title")
+    journal = _first(_xp_xlink_journal_title(meta))
     if journal is None:
-        journal = meta.find(".//journal-title")
+        journal = _first(_xp_journal_title(meta))
     return get_text(journal).strip() if journal is not None else ""
 
 
 def extract_pmcid(meta) -> str:
     """Extract PMC ID."""
-    for aid in meta.findall(".//article-id"):
-        if aid.get("pub-id-type") == "pmc":
-            return f"PMC{aid.text}" if aid.text else ""
-    return ""
+    aid = _first(_xp_pmc_article_id(meta))
+    if aid is None:
+        return ""
+    return f"PMC{aid.text}" if aid.text else ""
 
 
 # =============================================================================
 # Text Cleaning
 # =============================================================================
 
+_CITE_RE = re.compile(r'\[[\d,\s\-–]+\]')
+_DOT_RE = re.compile(r'\.{2,}')
+
+
 def clean_text(text: str) -> str:
     """Clean extracted text."""
     if not text:
         return ""
     
-    # Replace multiple whitespace with single space
-    text = re.sub(r'\s+', ' ', text)
-    
     # Remove citation markers like [1], [1,2], [1-3]
-    text = re.sub(r'\[[\d,\s\-–]+\]', '', text)
+    if "[" in text:
+        text = _CITE_RE.sub('', text)
     
-    # Remove excessive periods
-    text = re.sub(r'\.{2,}', '.', text)
+    # Collapse whitespace runs to single spaces and strip the ends (split()
+    # uses the same whitespace set as \s, and also closes the gaps left by
+    # removed citations)
+    text = " ".join(text.split())
     
-    # Fix spacing around punctuation
-    text = re.sub(r'\s+([.,;:!?])', r'\1', text)
+    # Remove excessive periods
+    if ".." in text:
+        text = _DOT_RE.sub('.', text)
     
-    # Remove leading/trailing whitespace
-    text = text.strip()
+    # Fix spacing around punctuation (whitespace is single spaces by now)
+    if " " in text:
+        for punct in ".,;:!?":
+            text = text.replace(" " + punct, punct)
     
     return text
 
@@ -260,90 +295,293 @@ def clean_text(text: str) -> str:
 # Main Processing
 # =============================================================================
 
-def process_single_xml(xml_path: str) -> Optional[Dict]:
+# Articles need this many characters of body text (before cleaning)
+MIN_BODY_CHARS = 500
+
+# Smallest plain XML file that could pass the body-length gate: the body
+# text plus the <article>, <article-meta> and <body> markup around it
+MIN_XML_BYTES = MIN_BODY_CHARS + 100
+
+def process_single_xml(xml_path: str, keep_structured: bool = False,
+                       data: Optional[bytes] = None) -> Optional[Dict]:
     """
     Process a single XML file and return structured data.
     
+    Only the fields written to the outputs are returned; with keep_structured
+    the cleaned sections and figure/table captions are included as well.
+    `data` is the file content if it has already been read.
+    
     Returns None if the file is invalid or too short.
     """
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+        if data is None:
+            data = read_xml(xml_path)
+        
+        # The tree is built in C; a parser target (SAX-style callbacks) would
+        # call back into Python for every start/end/data event, which costs
+        # more than the whole parse.
+        root = ET.fromstring(data, XML_PARSER)
         
-        article = root.find(".//article")
-        if article is None:
+        if not _xp_article(root):
             return None
         
-        meta = article.find(".//article-meta")
+        # Drop reference lists (never used, often the bulk of the file), then
+        # prune the rest so that string values are exactly the kept text
+        ET.strip_elements(root, "ref-list", with_tail=False)
+        prepare_text_tree(root)
+        
+        meta = None
+        journal_meta = None
+        body = None
+        floats = []
+        for elem in root.iter(*CONTENT_TAGS):
+            tag = elem.tag
+            if tag == "fig" or tag == "table-wrap":
+                floats.append(elem)
+            elif tag == "body":
+                if body is None:
+                    body = elem
+            elif tag == "article-meta":
+                if meta is None:
+                    meta = elem
+            elif journal_meta is None:
+                journal_meta = elem
+        
         if meta is None:
             return None
         
+        body_sections = extract_body(body) if body is not None else []
+        
+        # Skip if too short (less than MIN_BODY_CHARS of body text, before
+        # cleaning); checked before captions are extracted and text is cleaned
+        body_text_len = sum(len(s["text"]) for s in body_sections)
+        if body_text_len < MIN_BODY_CHARS:
+            return None
+        
+        # Figures/tables often contain experimental conclusions
+        fig_captions = []
+        table_captions = []
+        for elem in floats:
+            caption = extract_caption(elem)
+            if caption:
+                if elem.tag == "fig":
+                    fig_captions.append(caption)
+                else:
+                    table_captions.append(caption)
+        
         # Extract all fields
         title = clean_text(extract_title(meta))
         abstract = clean_text(extract_abstract(meta))
         keywords = extract_keywords(meta)
-        journal = extract_journal(root.find(".//journal-meta") or meta)
-        pmcid = extract_pmcid(meta) or Path(xml_path).stem
+        has_journal_meta = journal_meta is not None and len(journal_meta)
+        journal = extract_journal(journal_meta if has_journal_meta else meta)
+        pmcid = extract_pmcid(meta) or Path(xml_path).name.split(".", 1)[0]
         
-        body_sections = extract_body(article)
-        fig_captions = [clean_text(c) for c in extract_figure_captions(article)]
-        table_captions = [clean_text(c) for c in extract_table_captions(article)]
+        # Clean each section once; reused for full_text and "sections"
+        sections = [{"title": s["title"], "text": clean_text(s["text"])}
+                    for s in body_sections]
+        fig_captions = [clean_text(c) for c in fig_captions]
+        table_captions = [clean_text(c) for c in table_captions]
         
-        # Build full text
-        full_text_parts = []
+        # Build full text from raw pieces joined once. Every block starts
+        # with its "\n" separator; the first one is dropped at the end.
+        pieces = []
+        add = pieces.append
         
         if title:
-            full_text_parts.append(f"Title: {title}")
+            add("\nTitle: ")
+            add(title)
         
         if abstract:
-            full_text_parts.append(f"\nAbstract: {abstract}")
+            add("\n\nAbstract: ")
+            add(abstract)
         
         if keywords:
-            full_text_parts.append(f"\nKeywords: {', '.join(keywords)}")
+            add("\n\nKeywords: ")
+            add(", ".join(keywords))
         
-        for section in body_sections:
+        for section in sections:
             sec_title = section["title"]
-            sec_text = clean_text(section["text"])
+            add("\n\n")
             if sec_title:
-                full_text_parts.append(f"\n{sec_title}\n{sec_text}")
-            else:
-                full_text_parts.append(f"\n{sec_text}")
+                add(sec_title)
+                add("\n")
+            add(section["text"])
         
         if fig_captions:
-            full_text_parts.append("\nFigure Descriptions:")
+            add("\n\nFigure Descriptions:")
             for cap in fig_captions:
-                full_text_parts.append(f"  {cap}")
+                add("\n  ")
+                add(cap)
         
         if table_captions:
-            full_text_parts.append("\nTable Descriptions:")
+            add("\n\nTable Descriptions:")
             for cap in table_captions:
-                full_text_parts.append(f"  {cap}")
+                add("\n  ")
+                add(cap)
         
-        full_text = "\n".join(full_text_parts)
+        if pieces:
+            pieces[0] = pieces[0][1:]
+        full_text = "".join(pieces)
         
-        # Skip if too short (less than 500 chars of body text)
-        body_text_len = sum(len(s["text"]) for s in body_sections)
-        if body_text_len < 500:
-            return None
-        
-        return {
+        result = {
             "pmcid": pmcid,
             "title": title,
             "abstract": abstract,
             "keywords": keywords,
             "journal": journal,
-            "sections": [{"title": s["title"], "text": clean_text(s["text"])} 
-                        for s in body_sections],
-            "figure_captions": fig_captions,
-            "table_captions": table_captions,
             "full_text": full_text,
             "text_length": len(full_text),
         }
+        if keep_structured:
+            result["sections"] = sections
+            result["figure_captions"] = fig_captions
+            result["table_captions"] = table_captions
+        return result
         
     except Exception as e:
         return None
 
 
+# Separator written after every document in the TXT output
+DOC_SEPARATOR = ("\n\n" + "=" * 40 + "\n\n").encode("utf-8")
+
+
+def process_xml_record(xml_path: str, keep_structured: bool = False,
+                       data: Optional[bytes] = None, write_jsonl: bool = True,
+                       write_txt: bool = True) -> Optional[Tuple[str, int, bytes, bytes]]:
+    """
+    Pool worker: process one XML file into its output record.
+    
+    Returns (pmcid, text_length, jsonl_line, txt_block), both outputs already
+    encoded (the TXT block includes its document separator), so encoding
+    runs in parallel and only the final bytes cross the process boundary.
+    A format that is not written comes back as b"".
+    """
+    r = process_single_xml(xml_path, keep_structured, data)
+    if r is None:
+        return None
+    
+    jsonl_line = txt_block = b""
+    if write_jsonl:
+        # Compact version for training
+        doc = {
+            "pmcid": r["pmcid"],
+            "title": r["title"],
+            "abstract": r["abstract"],
+            "keywords": r["keywords"],
+            "journal": r["journal"],
+            "text": r["full_text"],
+        }
+        if keep_structured:
+            doc["sections"] = r["sections"]
+            doc["figure_captions"] = r["figure_captions"]
+            doc["table_captions"] = r["table_captions"]
+        jsonl_line = orjson.dumps(doc, option=orjson.OPT_APPEND_NEWLINE)
+    if write_txt:
+        txt_block = r["full_text"].encode("utf-8") + DOC_SEPARATOR
+    return r["pmcid"], r["text_length"], jsonl_line, txt_block
+
+
+# Files per worker task (amortizes dispatch and pickling over many files)
+BATCH_SIZE = 64
+
+# Output pieces collected per writelines() call
+WRITE_BATCH = 1000
+
+# Buffer size for output files (fewer, larger write() syscalls)
+OUTPUT_BUFFER = 1 << 20
+
+# zstd level for --compress-jsonl (compressed on all cores)
+JSONL_ZSTD_LEVEL = 3
+
+# Reader threads per worker process: a batch's files are read ahead while
+# earlier ones are parsed, so the worker's CPU does not sit idle on disk I/O
+READ_AHEAD_THREADS = 4
+
+# Per-worker state from init_worker (tasks are (start, stop) spans of _names)
+_input_dir = ""
+_names: List[str] = []
+_keep_structured = False
+_write_jsonl = True
+_write_txt = True
+_reader: Optional[ThreadPoolExecutor] = None
+
+
+def init_worker(input_dir: str, names: List[str], keep_structured: bool = False,
+                write_jsonl: bool = True, write_txt: bool = True):
+    """Pool initializer: remember the input files and output options."""
+    global _input_dir, _names, _keep_structured, _write_jsonl, _write_txt, _reader
+    _input_dir = input_dir
+    _names = names
+    _keep_structured = keep_structured
+    _write_jsonl = write_jsonl
+    _write_txt = write_txt
+    _reader = ThreadPoolExecutor(max_workers=READ_AHEAD_THREADS)
+
+
+def process_batch(span: Tuple[int, int]) -> Tuple[int, List[Tuple[str, int, bytes, bytes]]]:
+    """
+    Pool worker: process the files _names[start:stop] from the input directory.
+    
+    All reads of the batch are queued on the worker's reader threads up
+    front; files are parsed in order as their contents arrive.
+    
+    Returns: (files_processed, records) with skipped files left out
+    """
+    start, stop = span
+    paths = [os.path.join(_input_dir, name) for name in _names[start:stop]]
+    records = []
+    for path, data in zip(paths, _reader.map(read_xml_or_none, paths)):
+        record = process_xml_record(path, _keep_structured, data,
+                                    _write_jsonl, _write_txt)
+        if record is not None:
+            records.append(record)
+    return len(paths), records
+
+
+def copy_spans(index: List[Tuple], outputs: List[Tuple[Path, Path, int, bool]], desc: str):
+    """
+    Copy byte spans out of spill files, in index order, in a single pass.
+    
+    outputs: (src_path, dst_path, column, compress) per file, where index
+    rows hold the span's offset at `column` and its size at `column + 1`;
+    with compress the file is written as a zstd stream
+    """
+    with ExitStack() as stack:
+        targets = []
+        for src_path, dst_path, column, compress in outputs:
+            src = stack.enter_context(open(src_path, "rb"))
+            f = stack.enter_context(open(dst_path, "wb", buffering=OUTPUT_BUFFER))
+            if compress:
+                # The zstd writer has no writelines(); a BufferedWriter adds it
+                cctx = zstd.ZstdCompressor(level=JSONL_ZSTD_LEVEL, threads=-1)
+                f = stack.enter_context(
+                    io.BufferedWriter(cctx.stream_writer(f), OUTPUT_BUFFER))
+            if not os.fstat(src.fileno()).st_size:
+                continue  # mmap cannot map an empty file
+            mm = stack.enter_context(
+                mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ))
+            view = memoryview(mm)
+            stack.callback(view.release)
+            targets.append((view, f, column, []))
+        
+        if not targets:
+            return
+        
+        for row in tqdm(index, desc=desc, unit="doc"):
+            for view, f, column, pending in targets:
+                offset = row[column]
+                pending.append(view[offset:offset + row[column + 1]])
+                if len(pending) >= WRITE_BATCH:
+                    f.writelines(pending)
+                    pending.clear()
+        
+        for view, f, column, pending in targets:
+            f.writelines(pending)
+            pending.clear()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Preprocess PMC XML articles for LLM training"
@@ -352,7 +590,7 @@ def main():
         "--input-dir", "-i",
         type=str,
         default="data/xml",
-        help="Directory containing XML files"
+        help="Directory containing XML files (.xml or .xml.zst)"
     )
     parser.add_argument(
         "--output-dir", "-o",
@@ -378,6 +616,16 @@ def main():
         default=None,
         help="Max files to process (for testing)"
     )
+    parser.add_argument(
+        "--keep-structured",
+        action="store_true",
+        help="Also write sections and figure/table captions to the JSONL"
+    )
+    parser.add_argument(
+        "--compress-jsonl",
+        action="store_true",
+        help="Write the JSONL zstd-compressed (food_science_corpus.raw.jsonl.zst)"
+    )
     
     args = parser.parse_args()
     
@@ -410,10 +658,24 @@ def main():
     logger.info(f"Output: {output_dir}")
     logger.info(f"Workers: {num_workers}")
     
-    # Get XML files
-    xml_files = sorted(input_dir.glob("PMC*.xml"))
-    if args.max_files:
-        xml_files = xml_files[:args.max_files]
+    # Get XML files (plain or zstd-compressed), with the sizes of plain ones
+    # (the size of a compressed file says nothing about its text). They are
+    # taken in directory order: outputs are sorted by PMCID at the end
+    xml_files = []
+    if input_dir.is_dir():
+        with os.scandir(input_dir) as it:
+            for entry in it:
+                name = entry.name
+                if not name.startswith("PMC"):
+                    continue
+                if name.endswith(".xml"):
+                    xml_files.append((name, entry.stat().st_size))
+                elif name.endswith(".xml.zst"):
+                    xml_files.append((name, None))
+                else:
+                    continue
+                if len(xml_files) == args.max_files:
+                    break
     
     logger.info(f"Found {len(xml_files):,} XML files")
     
@@ -421,81 +683,142 @@ def main():
         logger.error("No XML files found!")
         return
     
+    # Files too small to hold MIN_BODY_CHARS of body text are skipped
+    # without being parsed (or sent to a worker)
+    names = [name for name, size in xml_files if size is None or size >= MIN_XML_BYTES]
+    too_small = len(xml_files) - len(names)
+    if too_small:
+        logger.info(f"Skipping {too_small:,} files under {MIN_XML_BYTES} bytes")
+    
     # Process in parallel
     logger.info(f"Processing with {num_workers} workers...")
     
-    xml_paths = [str(f) for f in xml_files]
-    
-    results = []
-    skipped = 0
+    # Workers get the name list once, at startup; tasks are index spans
+    batches = [(i, min(i + BATCH_SIZE, len(names)))
+               for i in range(0, len(names), BATCH_SIZE)]
+    
+    # Forked workers inherit the module state (compiled XPaths, regexes, the
+    # name list) copy-on-write instead of re-importing it as spawn would
+    if sys.platform == "linux":
+        set_start_method("fork", force=True)
+    
+    write_jsonl = args.format in ("jsonl", "both")
+    write_txt = args.format in ("txt", "both")
+    jsonl_path = intermediate_dir / "food_science_corpus.raw.jsonl"
+    jsonl_out = jsonl_path
+    if args.compress_jsonl:
+        jsonl_out = jsonl_path.with_name(jsonl_path.name + ".zst")
+    txt_path = intermediate_dir / "food_science_corpus.raw.txt"
+    
+    # Records are streamed to unsorted spill files as they arrive; only this
+    # small index is kept in memory (stats are running totals):
+    # (pmcid, jsonl_offset, jsonl_size, txt_offset, txt_size)
+    jsonl_unsorted = jsonl_path.with_name(jsonl_path.name + ".unsorted")
+    txt_unsorted = txt_path.with_name(txt_path.name + ".unsorted")
+    index = []
+    jsonl_pending = []
+    txt_pending = []
+    jsonl_offset = 0
+    txt_offset = 0
+    n_success = 0
+    total_chars = 0
+    skipped = too_small
     errors = 0
     
-    with Pool(num_workers) as pool:
-        for result in tqdm(
-            pool.imap_unordered(process_single_xml, xml_paths, chunksize=100),
-            total=len(xml_paths),
-            desc="Processing",
-            unit="xml"
-        ):
-            if result is not None:
-                results.append(result)
-            else:
-                skipped += 1
+    # A few chunks of batches per worker keeps the load balanced
+    chunksize = max(1, len(batches) // (num_workers * 8))
+    
+    with ExitStack() as stack:
+        # Spill files only for the formats being written
+        if write_jsonl:
+            f_jsonl = stack.enter_context(
+                open(jsonl_unsorted, "wb", buffering=OUTPUT_BUFFER))
+        if write_txt:
+            f_txt = stack.enter_context(
+                open(txt_unsorted, "wb", buffering=OUTPUT_BUFFER))
+        pool = stack.enter_context(Pool(
+            num_workers, initializer=init_worker,
+            initargs=(str(input_dir), names, args.keep_structured, write_jsonl, write_txt)))
+        pbar = stack.enter_context(tqdm(total=len(names), desc="Processing", unit="xml"))
+        
+        for count, records in pool.imap_unordered(process_batch, batches,
+                                                  chunksize=chunksize):
+            for pmcid, text_length, jsonl_line, txt_block in records:
+                # Unused formats come back as b"" and take no space
+                jsonl_size = len(jsonl_line)
+                txt_size = len(txt_block)
+                if write_jsonl:
+                    jsonl_pending.append(jsonl_line)
+                if write_txt:
+                    txt_pending.append(txt_block)
+                index.append((pmcid, jsonl_offset, jsonl_size, txt_offset, txt_size))
+                jsonl_offset += jsonl_size
+                txt_offset += txt_size
+                n_success += 1
+                total_chars += text_length
+            
+            if len(jsonl_pending) >= WRITE_BATCH:
+                f_jsonl.writelines(jsonl_pending)
+                jsonl_pending.clear()
+            if len(txt_pending) >= WRITE_BATCH:
+                f_txt.writelines(txt_pending)
+                txt_pending.clear()
+            
+            skipped += count - len(records)
+            pbar.update(count)
+        
+        if write_jsonl:
+            f_jsonl.writelines(jsonl_pending)
+        if write_txt:
+            f_txt.writelines(txt_pending)
     
     logger.info(f"\nProcessing complete!")
-    logger.info(f"  Successful: {len(results):,}")
+    logger.info(f"  Successful: {n_success:,}")
     logger.info(f"  Skipped (too short/invalid): {skipped:,}")
     
     # Sort by PMCID
-    results.sort(key=lambda x: x["pmcid"])
+    index.sort(key=itemgetter(0))
     
     # Calculate stats
-    total_chars = sum(r["text_length"] for r in results)
-    avg_chars = total_chars // len(results) if results else 0
+    avg_chars = total_chars // max(n_success, 1)
     
     logger.info(f"\nText Statistics:")
     logger.info(f"  Total text: {total_chars / 1e6:.1f} M characters")
     logger.info(f"  Average per article: {avg_chars:,} characters")
     logger.info(f"  Estimated tokens: ~{total_chars // 4 / 1e6:.1f} M tokens")
     
-    # Save outputs
-    if args.format in ("jsonl", "both"):
-        jsonl_path = intermediate_dir / "food_science_corpus.raw.jsonl"
-        logger.info(f"\nWriting JSONL to {jsonl_path}...")
-        with open(jsonl_path, "w", encoding="utf-8") as f:
-            for r in tqdm(results, desc="Writing JSONL", unit="doc"):
-                # Write compact version for training
-                doc = {
-                    "pmcid": r["pmcid"],
-                    "title": r["title"],
-                    "abstract": r["abstract"],
-                    "keywords": r["keywords"],
-                    "journal": r["journal"],
-                    "text": r["full_text"],
-                }
-                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
-        logger.info(f"  Size: {jsonl_path.stat().st_size / 1e9:.2f} GB")
-    
-    if args.format in ("txt", "both"):
-        txt_path = intermediate_dir / "food_science_corpus.raw.txt"
+    # Save outputs in PMCID order, copying each record out of the
+    # memory-mapped spill files (both formats in one pass over the index)
+    outputs = []
+    if write_jsonl:
+        logger.info(f"\nWriting JSONL to {jsonl_out}...")
+        outputs.append((jsonl_unsorted, jsonl_out, 1, args.compress_jsonl))
+    if write_txt:
         logger.info(f"\nWriting TXT to {txt_path}...")
-        with open(txt_path, "w", encoding="utf-8") as f:
-            for r in tqdm(results, desc="Writing TXT", unit="doc"):
-                f.write(r["full_text"])
-                f.write("\n\n" + "=" * 40 + "\n\n")  # Document separator
-        logger.info(f"  Size: {txt_path.stat().st_size / 1e9:.2f} GB")
+        outputs.append((txt_unsorted, txt_path, 3, False))
+    copy_spans(index, outputs, "Writing")
+    
+    if write_jsonl:
+        logger.info(f"  JSONL size: {jsonl_out.stat().st_size / 1e9:.2f} GB")
+    if write_txt:
+        logger.info(f"  TXT size: {txt_path.stat().st_size / 1e9:.2f} GB")
+    
+    if write_jsonl:
+        jsonl_unsorted.unlink()
+    if write_txt:
+        txt_unsorted.unlink()
     
     # Save stats
     stats = {
-        "total_articles": len(results),
+        "total_articles": n_success,
         "skipped_articles": skipped,
         "total_characters": total_chars,
         "avg_characters": avg_chars,
         "estimated_tokens": total_chars // 4,
     }
     stats_path = intermediate_dir / "corpus_stats.raw.json"
-    with open(stats_path, "w") as f:
-        json.dump(stats, f, indent=2)
+    with open(stats_path, "wb") as f:
+        f.write(orjson.dumps(stats, option=orjson.OPT_INDENT_2))
     
     logger.info(f"\nDone! Output saved to: {output_dir}")
 